@@ -0,0 +1,139 @@
+import json
+import socket
+import logging
+import ipaddress
+
+
+# destination access control, rules are compiled into tries so that a lookup costs
+# O(prefix length) for addresses and O(label count) for domain names:
+#   "10.0.0.0/8", "fc00::/7"  -> binary prefix trie, one for each address family
+#   "example.com"             -> reversed label trie, also matches any subdomain
+
+rules = None
+
+
+class PrefixTrie:
+    # node: [child_0, child_1, terminal]
+    def __init__(self, bits):
+        self._bits = bits
+        self._root = [None, None, False]
+
+    def insert(self, value, prefix_len):
+        node = self._root
+        for i in range(prefix_len):
+            if node[2]:
+                return  # already covered by a shorter prefix
+            bit = (value >> (self._bits - 1 - i)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, False]
+            node = node[bit]
+        node[0], node[1], node[2] = None, None, True
+
+    def match(self, value):
+        node = self._root
+        for i in range(self._bits):
+            if node[2]:
+                return True
+            node = node[(value >> (self._bits - 1 - i)) & 1]
+            if node is None:
+                return False
+        return node[2]
+
+
+class DomainTrie:
+    # node: {label: child}, terminal node is marked by key None
+    def __init__(self):
+        self._root = {}
+
+    def insert(self, domain):
+        node = self._root
+        for label in reversed(self._split(domain)):
+            if None in node:
+                return  # already covered by a parent domain
+            node = node.setdefault(label, {})
+        node.clear()
+        node[None] = True
+
+    def match(self, domain):
+        node = self._root
+        for label in reversed(self._split(domain)):
+            node = node.get(label)
+            if node is None:
+                return False
+            if None in node:
+                return True
+        return False
+
+    @staticmethod
+    def _split(domain):
+        return domain.strip('.').lower().split('.')
+
+
+class ACL:
+    def __init__(self, block):
+        self._ipv4 = PrefixTrie(32)
+        self._ipv6 = PrefixTrie(128)
+        self._domains = DomainTrie()
+        for rule in block:
+            self._insert(rule)
+
+    def is_blocked(self, addr):
+        if isinstance(addr, bytes):
+            addr = addr.decode('utf-8', errors='replace')
+        try:
+            packed = socket.inet_pton(socket.AF_INET, addr)
+            return self._ipv4.match(int.from_bytes(packed, 'big'))
+        except (OSError, ValueError):
+            pass
+        try:
+            packed = socket.inet_pton(socket.AF_INET6, addr.split('%', 1)[0])
+        except (OSError, ValueError):
+            return self._domains.match(addr)
+        if packed[:12] == b'\x00' * 10 + b'\xff\xff':  # ipv4-mapped
+            return self._ipv4.match(int.from_bytes(packed[12:], 'big'))
+        return self._ipv6.match(int.from_bytes(packed, 'big'))
+
+    def _insert(self, rule):
+        if not isinstance(rule, str):
+            raise ValueError('invalid acl rule {}'.format(rule))
+        try:
+            network = ipaddress.ip_network(rule, strict=False)
+        except ValueError:
+            if not rule or any(not label for label in rule.strip('.').split('.')):
+                raise ValueError('invalid acl rule {}'.format(rule))
+            self._domains.insert(rule)
+            return
+        if network.version == 4:
+            self._ipv4.insert(int(network.network_address), network.prefixlen)
+        else:
+            self._ipv6.insert(int(network.network_address), network.prefixlen)
+
+
+def load(config):
+    global rules
+    if config is None:
+        rules = None
+        return
+    if not isinstance(config, dict):
+        raise ValueError('acl must be an object')
+    block = config.get('block', None)
+    if not isinstance(block, list):
+        raise ValueError('acl.block must be a list')
+    rules = ACL(block)
+
+
+def reload(path):
+    try:
+        with open(path) as f:
+            config = json.load(f)
+        if not isinstance(config, dict):
+            raise ValueError('config must be an object')
+        load(config.get('acl', None))
+    except (IOError, OSError, ValueError) as e:
+        logging.warning('reload acl failed, keep the previous rules, e={}'.format(e))
+    else:
+        logging.info('acl reloaded')
+
+
+def is_allowed(addr):
+    return rules is None or not rules.is_blocked(addr)
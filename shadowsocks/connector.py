@@ -0,0 +1,144 @@
+import time
+import socket
+import logging
+import asyncio
+
+
+# followed rfc8305 (happy eyeballs v2), resolved addresses are interleaved by family and
+# connected in a staggered way, the first established socket wins and the others are dropped
+
+
+class Connector:
+    FAILURE_TTL = 600
+    FAILURE_CACHE_SIZE = 4096
+
+    def __init__(self, attempt_delay=0.25, timeout=10, addr_filter=None):
+        self._logger = logging.getLogger('<Connector {}>'.format(hex(id(self))))
+        self._attempt_delay = attempt_delay
+        self._timeout = timeout
+        self._addr_filter = addr_filter
+        self._failed = {}  # host -> {family: expire_time}
+
+    async def create_connection(self, protocol_factory, host, port):
+        coro = self._create_connection(protocol_factory, host, port)
+        return await asyncio.wait_for(coro, self._timeout)
+
+    async def _create_connection(self, protocol_factory, host, port):
+        loop = asyncio.get_event_loop()
+        infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        if not infos:
+            raise OSError('getaddrinfo() returned empty list')
+        if self._addr_filter is not None:
+            # a domain may still resolve to a blocked address
+            infos = [info for info in infos if self._addr_filter(info[4][0])]
+            if not infos:
+                raise OSError('all resolved addresses of {} are blocked'.format(host))
+        sock = await self._staggered_connect(host, self._sort_addrinfo(host, infos))
+        try:
+            return await loop.create_connection(protocol_factory, sock=sock)
+        except BaseException:
+            sock.close()
+            raise
+
+    def _sort_addrinfo(self, host, infos):
+        # families which failed recently for this host are tried last, they are still kept as
+        # fallbacks in case the preferred ones fail this time
+        failed = self._get_failed_families(host)
+        preferred = [info for info in infos if info[0] not in failed]
+        fallback = [info for info in infos if info[0] in failed]
+        return self._interleave(preferred) + self._interleave(fallback)
+
+    @staticmethod
+    def _interleave(infos):
+        # interleave families, starting with the first one returned by the resolver
+        by_family = {}
+        families = []
+        for info in infos:
+            if info[0] not in by_family:
+                by_family[info[0]] = []
+                families.append(info[0])
+            by_family[info[0]].append(info)
+        interleaved = []
+        while any(by_family.values()):
+            for family in families:
+                if by_family[family]:
+                    interleaved.append(by_family[family].pop(0))
+        return interleaved
+
+    async def _staggered_connect(self, host, infos):
+        loop = asyncio.get_event_loop()
+        pending = set()
+        families = {}
+        errors = []
+        failed_families = set()
+        winner = None
+        try:
+            while winner is None and (infos or pending):
+                if infos:
+                    family, type_, proto, _, sockaddr = infos.pop(0)
+                    fut = asyncio.ensure_future(self._connect_sock(loop, family, type_, proto, sockaddr))
+                    families[fut] = family
+                    pending.add(fut)
+                # start next attempt after attempt_delay, or immediately if one fails
+                timeout = self._attempt_delay if infos else None
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for fut in done:
+                    if fut.exception() is not None:
+                        errors.append(fut.exception())
+                        failed_families.add(families[fut])
+                    elif winner is None:
+                        winner = fut.result()
+                    else:
+                        fut.result().close()
+        finally:
+            for fut in pending:
+                if not fut.cancel() and not fut.cancelled() and fut.exception() is None:
+                    fut.result().close()
+
+        if winner is None:
+            if len(errors) == 1:
+                raise errors[0]
+            raise OSError('multiple exceptions: {}'.format(', '.join(str(e) for e in errors)))
+
+        # families that never produced the winner are either broken or blackholed, an attempt of the
+        # latter just hangs and is cancelled while pending, so count every tried family as failed
+        failed_families.update(families.values())
+        failed_families.discard(winner.family)
+        for family in failed_families:
+            self._set_failed_family(host, family)
+        self._clear_failed_family(host, winner.family)
+        return winner
+
+    async def _connect_sock(self, loop, family, type_, proto, sockaddr):
+        sock = socket.socket(family, type_, proto)
+        try:
+            sock.setblocking(False)
+            await loop.sock_connect(sock, sockaddr)
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    def _get_failed_families(self, host):
+        record = self._failed.get(host)
+        if record is None:
+            return set()
+        current_time = time.time()
+        for family in [family for family, expire_time in record.items() if expire_time < current_time]:
+            del record[family]
+        if not record:
+            del self._failed[host]
+        return set(record)
+
+    def _set_failed_family(self, host, family):
+        self._logger.debug('{} failed for {}'.format(family, host))
+        if host not in self._failed and len(self._failed) >= self.FAILURE_CACHE_SIZE:
+            self._failed.pop(next(iter(self._failed)))
+        self._failed.setdefault(host, {})[family] = time.time() + self.FAILURE_TTL
+
+    def _clear_failed_family(self, host, family):
+        record = self._failed.get(host)
+        if record is not None:
+            record.pop(family, None)
+            if not record:
+                del self._failed[host]
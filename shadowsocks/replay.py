@@ -0,0 +1,194 @@
+import time
+import socket
+import struct
+import logging
+import asyncio
+import argparse
+from shadowsocks import shell, cryptor, protocol, connector, server, trace, acl
+
+
+# replay recorded traces through a local server, the replay client plays the upstream side of
+# each session and the sink origin plays the downstream side, every session starts with a preamble
+# carrying the session index so that the sink knows which one to play.
+
+PREAMBLE = struct.Struct('!I')
+
+
+def _end_offset(session):
+    if session.events:
+        return session.events[-1][0]
+    return 0.0
+
+
+class SinkOrigin(asyncio.Protocol):
+    def __init__(self, sessions, speed):
+        self._logger = logging.getLogger('<SinkOrigin {}>'.format(hex(id(self))))
+        self._sessions = sessions
+        self._speed = speed
+        self._transport = None
+        self._buffer = b''
+        self._task = None
+        self._eof_sent = False
+        self._eof_received = False
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def data_received(self, data):
+        if self._task is not None:
+            return  # upstream payload is discarded
+        self._buffer += data
+        if len(self._buffer) >= PREAMBLE.size:
+            (index,) = PREAMBLE.unpack(self._buffer[:PREAMBLE.size])
+            self._buffer = b''
+            self._task = asyncio.ensure_future(self._play(self._sessions[index]))
+
+    def eof_received(self):
+        self._eof_received = True
+        if self._eof_sent:
+            return None
+        return True
+
+    def connection_lost(self, exc):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _play(self, session):
+        loop = asyncio.get_event_loop()
+        start_time = loop.time()
+        for offset, event, size in session.events:
+            if event == trace.EVENT_DOWN:
+                await asyncio.sleep(max(0.0, start_time + offset / self._speed - loop.time()))
+                self._transport.write(bytes(size))
+        await asyncio.sleep(max(0.0, start_time + _end_offset(session) / self._speed - loop.time()))
+        self._eof_sent = True
+        if self._eof_received:
+            self._transport.close()
+        else:
+            self._transport.write_eof()
+
+
+class ReplayClient(asyncio.Protocol):
+    def __init__(self, index, session, key, speed, sink_port, done):
+        self._logger = logging.getLogger('<ReplayClient{0} {1}>'.format(index, hex(id(self))))
+        self._index = index
+        self._session = session
+        self._speed = speed
+        self._sink_port = sink_port
+        self._done = done
+        self._encryptor = cryptor.Cryptor(protocol.TRANSPORT_TCP, key)
+        self._decryptor = cryptor.Cryptor(protocol.TRANSPORT_TCP, key)
+        self._transport = None
+        self._task = None
+        self._start_time = None
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def connection_made(self, transport):
+        self._transport = transport
+        self._start_time = asyncio.get_event_loop().time()
+        self._task = asyncio.ensure_future(self._play())
+
+    def data_received(self, data):
+        self.bytes_received += len(self._decryptor.decrypt(data))
+
+    def eof_received(self):
+        self._logger.debug('eof received')
+
+    def connection_lost(self, exc):
+        self._logger.debug('lost exc={exc}'.format(exc=exc))
+        if self._task is not None:
+            self._task.cancel()
+        if not self._done.done():
+            self._done.set_result(asyncio.get_event_loop().time() - self._start_time)
+
+    async def _play(self):
+        loop = asyncio.get_event_loop()
+        header = b'\x01' + socket.inet_aton('127.0.0.1') + struct.pack('!H', self._sink_port)
+        self._transport.write(self._encryptor.encrypt(header + PREAMBLE.pack(self._index)))
+        for offset, event, size in self._session.events:
+            if event == trace.EVENT_UP:
+                await asyncio.sleep(max(0.0, self._start_time + offset / self._speed - loop.time()))
+                self._transport.write(self._encryptor.encrypt(bytes(size)))
+                self.bytes_sent += size
+        await asyncio.sleep(max(0.0, self._start_time + _end_offset(self._session) / self._speed - loop.time()))
+        if self._transport.can_write_eof():
+            self._transport.write_eof()
+
+
+async def _replay_session(index, session, key, speed, base_time, server_port, sink_port):
+    loop = asyncio.get_event_loop()
+    await asyncio.sleep(max(0.0, base_time + session.start_time / speed - loop.time()))
+    done = asyncio.Future()
+    try:
+        _, client = await loop.create_connection(
+            lambda: ReplayClient(index, session, key, speed, sink_port, done), '127.0.0.1', server_port)
+    except (IOError, OSError) as e:
+        logging.warning('session {} connection failed, e={}'.format(index, e))
+        return None
+    elapsed = await done
+    expected = sum(size for _, event, size in session.events if event == trace.EVENT_DOWN)
+    return index, elapsed, _end_offset(session) / speed, client.bytes_sent, client.bytes_received, expected
+
+
+async def replay(sessions, key, speed):
+    loop = asyncio.get_event_loop()
+    tcp_connector = connector.Connector(attempt_delay=shell.config['connect_attempt_delay'],
+                                        timeout=shell.config['connect_timeout'])
+    tcp_server = await loop.create_server(lambda: server.LocalTCP(key, tcp_connector), '127.0.0.1', 0)
+    sink_server = await loop.create_server(lambda: SinkOrigin(sessions, speed), '127.0.0.1', 0)
+    server_port = tcp_server.sockets[0].getsockname()[1]
+    sink_port = sink_server.sockets[0].getsockname()[1]
+
+    base_time = loop.time()
+    if sessions:
+        base_time -= sessions[0].start_time / speed
+    start_time = time.time()
+    coros = [_replay_session(index, session, key, speed, base_time, server_port, sink_port)
+             for index, session in enumerate(sessions)]
+    results = [result for result in await asyncio.gather(*coros) if result is not None]
+    total_time = time.time() - start_time
+
+    for server_ in (tcp_server, sink_server):
+        server_.close()
+        await server_.wait_closed()
+    return results, total_time
+
+
+def report(results, total_time):
+    bytes_sent = sum(result[3] for result in results)
+    bytes_received = sum(result[4] for result in results)
+    incomplete = [result[0] for result in results if result[4] != result[5]]
+    stretches = sorted(result[1] - result[2] for result in results if result[4] == result[5])
+    print('sessions: {}, total time: {:.3f}s'.format(len(results), total_time))
+    print('upstream: {} bytes, downstream: {} bytes'.format(bytes_sent, bytes_received))
+    if stretches:
+        print('session stretch: p50={:.3f}s p99={:.3f}s max={:.3f}s'.format(
+            stretches[len(stretches) // 2], stretches[int(len(stretches) * 0.99)], stretches[-1]))
+    if incomplete:
+        print('incomplete sessions: {}'.format(incomplete))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='replay recorded session traces against a local server')
+    parser.add_argument('trace_file')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed, 2.0 means twice as fast')
+    args = parser.parse_args()
+    if args.speed <= 0:
+        parser.error('speed must be positive')
+
+    shell.init_config()
+    shell.init_logging()
+    acl.load(None)  # the sink listens on loopback, which is usually blocked
+    _, key = shell.config['port_key'][0]
+    sessions = trace.load_sessions(args.trace_file)
+    logging.info('Replaying {} sessions at {}x'.format(len(sessions), args.speed))
+
+    loop = asyncio.get_event_loop()
+    results, total_time = loop.run_until_complete(replay(sessions, key, args.speed))
+    loop.close()
+    report(results, total_time)
+
+
+if __name__ == '__main__':
+    main()
@@ -17,11 +17,12 @@
 
 import time
 import random
+import signal
 import socket
 import logging
 import asyncio
 import struct
-from shadowsocks import shell, cryptor, protocol
+from shadowsocks import shell, cryptor, protocol, connector, trace, acl
 
 
 # addr: followed rfc1928, 8.8.8.8, ::::, www.google.com
@@ -34,12 +35,18 @@ class TimeoutHandler:
         self._transport = None
         self._last_active_time = time.time()
         self._timeout_limit = 20
+        self._keep_alive_task = None
 
     def close(self):
         raise NotImplementedError
 
     def keep_alive_open(self):
-        asyncio.ensure_future(self._keep_alive())
+        self._keep_alive_task = asyncio.ensure_future(self._keep_alive())
+
+    def keep_alive_close(self):
+        if self._keep_alive_task is not None:
+            self._keep_alive_task.cancel()
+            self._keep_alive_task = None
 
     def keep_alive_active(self):
         self._last_active_time = time.time()
@@ -67,8 +74,13 @@ class RemoteTCP(asyncio.Protocol, TimeoutHandler):
 
     def write(self, data):
         if self._transport is not None:
+            self.keep_alive_active()
             self._transport.write(data)
 
+    def write_eof(self):
+        if self._transport is not None and self._transport.can_write_eof():
+            self._transport.write_eof()
+
     def close(self):
         if self._transport is not None:
             self._transport.close()
@@ -83,14 +95,19 @@ class RemoteTCP(asyncio.Protocol, TimeoutHandler):
     def data_received(self, data):
         self.keep_alive_active()
         self._logger.debug('received len={}'.format(len(data)))
+        self._local.record_trace(trace.EVENT_DOWN, len(data))
         data = self._cryptor.encrypt(data)
         self._local.write(data)
 
     def eof_received(self):
         self._logger.debug('eof received')
+        self._local.handle_remote_eof_received()
+        # keep the transport open, we may still have data to send
+        return True
 
     def connection_lost(self, exc):
         self._logger.debug('lost exc={exc}'.format(exc=exc))
+        self.keep_alive_close()
         if self._local is not None:
             self._local.close()
 
@@ -123,6 +140,7 @@ class RemoteUDP(asyncio.DatagramProtocol, TimeoutHandler):
 
     def connection_lost(self, exc):
         self._logger.debug('lost exc={exc}'.format(exc=exc))
+        self.keep_alive_close()
 
     def datagram_received(self, data, peername):
         self.keep_alive_active()
@@ -145,25 +163,39 @@ class LocalHandler(TimeoutHandler):
     STAGE_STREAM = 2
     STAGE_ERROR = 0xFF
 
-    def __init__(self, key):
+    def __init__(self, key, tcp_connector=None):
         TimeoutHandler.__init__(self)
         self._key = key
+        self._tcp_connector = tcp_connector
         self._stage = self.STAGE_DESTROY
         self._peername = None
         self._transport = None
         self._transport_protocol = None
         self._remote = None
+        self._pending_data = []
+        self._local_eof = False
+        self._remote_eof = False
+        self._init_task = None
+        self._trace_id = None
         self._cryptor = None
         self._logger = None
 
     def write(self, data):
         if self._transport_protocol == protocol.TRANSPORT_TCP:
+            self.keep_alive_active()
             self._transport.write(data)
         elif self._transport_protocol == protocol.TRANSPORT_UDP:
             self._transport.sendto(data, self._peername)
         else:
             raise NotImplementedError
 
+    def write_eof(self):
+        if self._transport_protocol == protocol.TRANSPORT_TCP:
+            if self._transport is not None and self._transport.can_write_eof():
+                self._transport.write_eof()
+        else:
+            raise NotImplementedError
+
     def close(self):
         if self._transport_protocol == protocol.TRANSPORT_TCP:
             if self._transport is not None:
@@ -182,6 +214,8 @@ class LocalHandler(TimeoutHandler):
         self._peername = self._transport.get_extra_info('peername')
         self._logger = logging.getLogger('<LocalTCP{0} {1}>'.format(self._peername, hex(id(self))))
         self._logger.debug('tcp connection made')
+        if trace.recorder is not None:
+            self._trace_id = trace.recorder.open()
 
     def handle_udp_connection_made(self, transport, peername):
         self._stage = self.STAGE_INIT
@@ -197,10 +231,9 @@ class LocalHandler(TimeoutHandler):
         data = self._cryptor.decrypt(data)
         if self._stage == self.STAGE_INIT:
             coro = self._handle_stage_init(data)
-            asyncio.ensure_future(coro)
+            self._init_task = asyncio.ensure_future(coro)
         elif self._stage == self.STAGE_CONNECT:
-            coro = self._handle_stage_connect(data)
-            asyncio.ensure_future(coro)
+            self._handle_stage_connect(data)
         elif self._stage == self.STAGE_STREAM:
             self._handle_stage_stream(data)
         elif self._stage == self.STAGE_ERROR:
@@ -210,12 +243,46 @@ class LocalHandler(TimeoutHandler):
 
     def handle_eof_received(self):
         self._logger.debug('eof received')
+        self._local_eof = True
+        if self._stage == self.STAGE_STREAM:
+            self._remote.write_eof()
+        elif self._stage == self.STAGE_CONNECT or \
+                (self._stage == self.STAGE_INIT and self._init_task is not None and not self._init_task.done()):
+            pass  # propagated once the connection established
+        else:  # no connect is coming
+            return None  # let the transport close itself
+        self._close_if_shutdown()
+        # keep the transport open, the remote may still have data to send
+        return True
+
+    def handle_remote_eof_received(self):
+        self._logger.debug('remote eof received')
+        self._remote_eof = True
+        self.write_eof()
+        self._close_if_shutdown()
 
     def handle_connection_lost(self, exc):
         self._logger.debug('lost exc={exc}'.format(exc=exc))
+        self.keep_alive_close()
+        self.record_trace(trace.EVENT_CLOSE, 0)
+        self._trace_id = None
+        if self._init_task is not None:
+            self._init_task.cancel()  # the client is gone, do not keep connecting for it
         if self._remote is not None:
             self._remote.close()
 
+    def record_trace(self, event, size):
+        if self._trace_id is not None and trace.recorder is not None:
+            trace.recorder.record(self._trace_id, event, size)
+
+    def _close_if_shutdown(self):
+        # both directions are finished, release the session right now instead of waiting for time out
+        if self._local_eof and self._remote_eof:
+            self._logger.debug('both sides closed')
+            self.close()
+            if self._remote is not None:
+                self._remote.close()
+
     def _handle_exception(self):
         pass
 
@@ -239,16 +306,26 @@ class LocalHandler(TimeoutHandler):
             self.close()
             return
 
+        if not acl.is_allowed(dst_addr):
+            self._logger.warning('destination blocked, {}:{}'.format(dst_addr, dst_port))
+            if self._transport_protocol == protocol.TRANSPORT_TCP:
+                self.close()
+                self._stage = self.STAGE_DESTROY
+            return
+
         self._logger.debug('connecting {}:{}'.format(dst_addr, dst_port))
+        if payload:
+            self.record_trace(trace.EVENT_UP, len(payload))
 
         loop = asyncio.get_event_loop()
         if self._transport_protocol == protocol.TRANSPORT_TCP:
             self._stage = self.STAGE_CONNECT
-            coro = loop.create_connection(lambda: RemoteTCP(dst_addr, dst_port, payload, self._key, self),
-                                          dst_addr, dst_port)
+            self._transport.pause_reading()  # do not buffer more than what already arrived
+            coro = self._tcp_connector.create_connection(lambda: RemoteTCP(dst_addr, dst_port, payload, self._key, self),
+                                                         dst_addr, dst_port)
             try:
                 remote_transport, remote_instance = await coro
-            except (IOError, OSError) as e:
+            except (IOError, OSError, asyncio.TimeoutError) as e:
                 self._logger.debug('connection failed, {} e={}'.format(type(e), e))
                 self.close()
                 self._stage = self.STAGE_DESTROY
@@ -257,38 +334,55 @@ class LocalHandler(TimeoutHandler):
                 self.close()
                 self._stage = self.STAGE_ERROR
             else:
+                if self._transport.is_closing():
+                    self._logger.debug('connection established after local closed')
+                    remote_instance.close()
+                    self._stage = self.STAGE_DESTROY
+                    return
                 self._logger.debug('connection established, remote={}'.format(remote_instance))
                 self._remote = remote_instance
                 self._stage = self.STAGE_STREAM
+                for data in self._pending_data:
+                    self._remote.write(data)
+                self._pending_data = []
+                if self._local_eof:
+                    self._remote.write_eof()
+                else:
+                    self._transport.resume_reading()
         elif self._transport_protocol == protocol.TRANSPORT_UDP:
             self._stage = self.STAGE_INIT
+            remote_addr = (dst_addr, dst_port)
+            if atype == protocol.ATYPE_DOMAINNAME:
+                # a domain may still resolve to a blocked address, ip literals are checked above already
+                try:
+                    infos = await loop.getaddrinfo(dst_addr, dst_port, type=socket.SOCK_DGRAM)
+                except (IOError, OSError) as e:
+                    self._logger.debug('resolve failed, {} e={}'.format(type(e), e))
+                    return
+                infos = [info for info in infos if acl.is_allowed(info[4][0])]
+                if not infos:
+                    self._logger.warning('destination blocked, {}:{}'.format(dst_addr, dst_port))
+                    return
+                remote_addr = infos[0][4]
             coro = loop.create_datagram_endpoint(lambda: RemoteUDP(dst_addr, dst_port, payload, self._key, self),
-                                                 remote_addr=(dst_addr, dst_port))
+                                                 remote_addr=remote_addr)
             asyncio.ensure_future(coro)
         else:
             raise NotImplementedError
 
-    async def _handle_stage_connect(self, data):
+    def _handle_stage_connect(self, data):
         # after stage_init, it takes few time to connect to remote, but sometimes the impatient ss-client
-        # send next payload immediately, so we have to handle it.
+        # send next payload immediately, so we have to keep it until the connection established, reading
+        # is paused meanwhile so only what already arrived is kept, and the connector gives up after
+        # connect_timeout so there is no need to wait here.
         self._logger.debug('wait until connection established')
-        for i in range(30):
-            if self._stage == self.STAGE_CONNECT:  # continue waiting
-                await asyncio.sleep(0.2)
-            elif self._stage == self.STAGE_STREAM:  # remote_transport is not None
-                self._logger.debug('connection established')
-                self._remote.write(data)
-                return
-            else:  # some error arise
-                self._logger.debug('some error happened, stage={}'.format(self._stage))
-                return
-        # resolve time out, do something
-        self._logger.warning('time out, stage={}'.format(self._stage))
-        self.close()
+        self.record_trace(trace.EVENT_UP, len(data))
+        self._pending_data.append(data)
 
     def _handle_stage_stream(self, data):
         self._logger.debug('relay data')
         self.keep_alive_active()
+        self.record_trace(trace.EVENT_UP, len(data))
         self._remote.write(data)
 
     def _handle_stage_error(self):
@@ -298,8 +392,8 @@ class LocalHandler(TimeoutHandler):
 class LocalTCP(asyncio.Protocol):
     # this class will construct as long as a new connection is ready, and
     # connection_made will be called after the connection is established
-    def __init__(self, key):
-        self._handler = LocalHandler(key)
+    def __init__(self, key, tcp_connector):
+        self._handler = LocalHandler(key, tcp_connector)
 
     def connection_made(self, transport):
         self._handler.handle_tcp_connection_made(transport)
@@ -308,7 +402,7 @@ class LocalTCP(asyncio.Protocol):
         self._handler.handle_data_received(data)
 
     def eof_received(self):
-        self._handler.handle_eof_received()
+        return self._handler.handle_eof_received()
 
     def connection_lost(self, exc):
         self._handler.handle_connection_lost(exc)
@@ -340,12 +434,34 @@ class LocalUDP(asyncio.DatagramProtocol):
 
 def run_server():
     loop = asyncio.get_event_loop()
+    if hasattr(signal, 'SIGHUP'):
+        loop.add_signal_handler(signal.SIGHUP, acl.reload, shell.config_file)
+    tcp_connector = connector.Connector(attempt_delay=shell.config['connect_attempt_delay'],
+                                        timeout=shell.config['connect_timeout'],
+                                        addr_filter=acl.is_allowed)
+    if shell.config['trace_file'] is not None:
+        logging.info('Recording traces to {}'.format(shell.config['trace_file']))
+        trace.recorder = trace.TraceRecorder(shell.config['trace_file'])
+
+    try:
+        serve_forever(loop, tcp_connector)
+    finally:
+        if trace.recorder is not None:
+            trace.recorder.close()
+            trace.recorder = None
+
+    loop.close()
+
+
+def serve_forever(loop, tcp_connector):
+    if hasattr(signal, 'SIGTERM'):
+        loop.add_signal_handler(signal.SIGTERM, loop.stop)
 
     tcp_servers = []
     udp_transports = []
     for port, key in shell.config['port_key']:
         logging.info('Serving on {}:{}'.format(shell.config['local_address'], port))
-        tcp_server = loop.run_until_complete(loop.create_server(lambda: LocalTCP(key), shell.config['local_address'], port))
+        tcp_server = loop.run_until_complete(loop.create_server(lambda: LocalTCP(key, tcp_connector), shell.config['local_address'], port))
         tcp_servers.append(tcp_server)
         udp_transport, _ = loop.run_until_complete(
             loop.create_datagram_endpoint(lambda: LocalUDP(key), local_addr=(shell.config['local_address'], port)))
@@ -362,8 +478,6 @@ def run_server():
         tcp_server.close()
         loop.run_until_complete(tcp_server.wait_closed())
 
-    loop.close()
-
 
 if __name__ == '__main__':
     shell.init_config()
@@ -1,21 +1,31 @@
 import json
 import logging
-from shadowsocks import cryptor
+from shadowsocks import cryptor, acl
 
 supported_methods = {'aes-128-cfb': (16, 16, 'Stream'),
              'aes-192-cfb': (24, 16, 'Stream'),
              'aes-256-cfb': (32, 16, 'Stream')}
+config_file = 'shadowsocks.json'
 config = {}
-config_default = {}
+config_default = {'connect_timeout': 10,
+                  'connect_attempt_delay': 0.25,
+                  'trace_file': None}
 
 
 def init_config():
     global config
-    config = json.load(open('shadowsocks.json'))
+    config = json.load(open(config_file))
+    for key, value in config_default.items():
+        config.setdefault(key, value)
 
     if config.get('local_address', None) is None:
         raise ValueError('local_address must be assigned')
 
+    for key in ('connect_timeout', 'connect_attempt_delay'):
+        value = config[key]
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+            raise ValueError('{} must be a positive number'.format(key))
+
     if config.get('method', None) is None:
         raise ValueError('method must be assigned')
     if config['method'] not in supported_methods:
@@ -35,6 +45,8 @@ def init_config():
             m.append((port, key))
         config['port_key'] = m
 
+    acl.load(config.get('acl', None))
+
 
 def init_logging():
     handler = None
@@ -0,0 +1,94 @@
+import time
+import struct
+import logging
+
+
+# trace file is an append-only sequence of fixed size records, no payload is stored:
+#   conn_id(uint32) event(uint8) gap_us(uint32) size(uint32)
+# gap_us is the time since the previous record in the file, EVENT_BEGIN marks the start of a
+# recording session so that conn_id of different sessions will not be mixed up.
+
+VERSION = 0x01
+
+EVENT_BEGIN = 0x00
+EVENT_OPEN = 0x01
+EVENT_UP = 0x02
+EVENT_DOWN = 0x03
+EVENT_CLOSE = 0x04
+
+RECORD = struct.Struct('!IBII')
+MAX_GAP_US = 0xFFFFFFFF
+MAX_SIZE = 0xFFFFFFFF
+
+recorder = None
+
+
+class TraceRecorder:
+    def __init__(self, path):
+        self._logger = logging.getLogger('<TraceRecorder {}>'.format(path))
+        self._file = open(path, 'ab')
+        # drop a torn record left by an unclean shutdown, otherwise every record after it is misaligned
+        size = self._file.seek(0, 2)
+        if size % RECORD.size:
+            self._logger.warning('truncate {} bytes of partial record'.format(size % RECORD.size))
+            self._file.truncate(size - size % RECORD.size)
+        self._last_time = time.monotonic()  # wall clock may step backwards
+        self._last_conn_id = 0
+        self._write(0, EVENT_BEGIN, VERSION)
+
+    def open(self):
+        self._last_conn_id = (self._last_conn_id + 1) & 0xFFFFFFFF
+        self._write(self._last_conn_id, EVENT_OPEN, 0)
+        return self._last_conn_id
+
+    def record(self, conn_id, event, size):
+        self._write(conn_id, event, min(size, MAX_SIZE))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write(self, conn_id, event, size):
+        if self._file is None:
+            return
+        current_time = time.monotonic()
+        gap_us = min(max(0, int((current_time - self._last_time) * 1e6)), MAX_GAP_US)
+        self._last_time = current_time
+        try:
+            self._file.write(RECORD.pack(conn_id, event, gap_us, size))
+        except (IOError, OSError) as e:
+            self._logger.warning('write failed, disable recording, e={}'.format(e))
+            self.close()
+
+
+class TraceSession:
+    def __init__(self, conn_id):
+        self.conn_id = conn_id
+        self.start_time = 0.0
+        self.events = []  # (time offset from start, event, size)
+
+
+def load_sessions(path):
+    sessions = []
+    index = {}
+    segment = 0
+    current_time = 0.0
+    with open(path, 'rb') as f:
+        data = f.read()
+    for offset in range(0, len(data) - len(data) % RECORD.size, RECORD.size):
+        conn_id, event, gap_us, size = RECORD.unpack_from(data, offset)
+        current_time += gap_us / 1e6
+        if event == EVENT_BEGIN:
+            segment += 1
+        elif event == EVENT_OPEN:
+            session = TraceSession(conn_id)
+            session.start_time = current_time
+            sessions.append(session)
+            index[(segment, conn_id)] = session
+        elif (segment, conn_id) in index:
+            session = index[(segment, conn_id)]
+            session.events.append((current_time - session.start_time, event, size))
+            if event == EVENT_CLOSE:
+                del index[(segment, conn_id)]
+    return sessions
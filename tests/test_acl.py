@@ -0,0 +1,135 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from shadowsocks import acl
+
+
+class TestPrefixTrie(unittest.TestCase):
+    def test_prefix(self):
+        trie = acl.PrefixTrie(8)
+        trie.insert(0b10100000, 3)
+        self.assertTrue(trie.match(0b10100000))
+        self.assertTrue(trie.match(0b10111111))
+        self.assertFalse(trie.match(0b10000000))
+        self.assertFalse(trie.match(0b11100000))
+
+    def test_full_length(self):
+        trie = acl.PrefixTrie(8)
+        trie.insert(0b00000001, 8)
+        self.assertTrue(trie.match(0b00000001))
+        self.assertFalse(trie.match(0b00000000))
+
+    def test_zero_length(self):
+        trie = acl.PrefixTrie(8)
+        self.assertFalse(trie.match(0))
+        trie.insert(0, 0)
+        self.assertTrue(trie.match(0))
+        self.assertTrue(trie.match(0xFF))
+
+    def test_covered(self):
+        trie = acl.PrefixTrie(8)
+        trie.insert(0b10110000, 4)
+        trie.insert(0b10000000, 1)
+        trie.insert(0b11000000, 2)
+        self.assertTrue(trie.match(0b11111111))
+        self.assertFalse(trie.match(0b01111111))
+
+
+class TestDomainTrie(unittest.TestCase):
+    def setUp(self):
+        self.trie = acl.DomainTrie()
+        self.trie.insert('example.com')
+
+    def test_suffix(self):
+        self.assertTrue(self.trie.match('example.com'))
+        self.assertTrue(self.trie.match('a.b.example.com'))
+        self.assertTrue(self.trie.match('Example.COM.'))
+
+    def test_not_suffix(self):
+        self.assertFalse(self.trie.match('notexample.com'))
+        self.assertFalse(self.trie.match('com'))
+        self.assertFalse(self.trie.match('example.org'))
+        self.assertFalse(self.trie.match('example.com.cn'))
+
+    def test_covered(self):
+        self.trie.insert('a.example.com')
+        self.trie.insert('com')
+        self.assertTrue(self.trie.match('example.org.com'))
+
+
+class TestACL(unittest.TestCase):
+    def setUp(self):
+        self.acl = acl.ACL(['10.0.0.0/8', '127.0.0.0/8', 'fc00::/7', '::1/128', 'example.com'])
+
+    def test_ipv4(self):
+        self.assertTrue(self.acl.is_blocked('10.1.2.3'))
+        self.assertTrue(self.acl.is_blocked(b'127.0.0.1'))
+        self.assertFalse(self.acl.is_blocked('8.8.8.8'))
+        self.assertFalse(self.acl.is_blocked('11.0.0.0'))
+
+    def test_ipv6(self):
+        self.assertTrue(self.acl.is_blocked('fd00::1'))
+        self.assertTrue(self.acl.is_blocked('::1'))
+        self.assertFalse(self.acl.is_blocked('::2'))
+        self.assertFalse(self.acl.is_blocked('2001:db8::1'))
+
+    def test_ipv4_mapped(self):
+        self.assertTrue(self.acl.is_blocked('::ffff:10.0.0.1'))
+        self.assertFalse(self.acl.is_blocked('::ffff:8.8.8.8'))
+
+    def test_domain(self):
+        self.assertTrue(self.acl.is_blocked(b'www.example.com'))
+        self.assertFalse(self.acl.is_blocked('notexample.com'))
+
+    def test_zero_prefix(self):
+        rules = acl.ACL(['0.0.0.0/0'])
+        self.assertTrue(rules.is_blocked('8.8.8.8'))
+        self.assertFalse(rules.is_blocked('2001:db8::1'))
+
+    def test_invalid_rule(self):
+        for rule in (5, '', 'a..b', None):
+            with self.assertRaises(ValueError):
+                acl.ACL([rule])
+
+
+class TestLoad(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'shadowsocks.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        acl.load(None)
+
+    def _write(self, config):
+        with open(self.path, 'w') as f:
+            json.dump(config, f)
+
+    def test_load(self):
+        acl.load({'block': ['10.0.0.0/8']})
+        self.assertFalse(acl.is_allowed('10.0.0.1'))
+        acl.load(None)
+        self.assertTrue(acl.is_allowed('10.0.0.1'))
+        for config in (['10.0.0.0/8'], {}, {'block': '10.0.0.0/8'}):
+            with self.assertRaises(ValueError):
+                acl.load(config)
+
+    def test_reload(self):
+        self._write({'acl': {'block': ['example.com']}})
+        acl.reload(self.path)
+        self.assertFalse(acl.is_allowed('example.com'))
+
+    def test_reload_keep_previous(self):
+        acl.load({'block': ['example.com']})
+        for config in ([], {'acl': {'block': [5]}}):
+            self._write(config)
+            acl.reload(self.path)
+            self.assertFalse(acl.is_allowed('example.com'))
+        acl.reload(os.path.join(self.dir, 'missing.json'))
+        self.assertFalse(acl.is_allowed('example.com'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import socket
+import asyncio
+import unittest
+from shadowsocks import connector
+
+
+def _info(family, addr, port=80):
+    if family == socket.AF_INET6:
+        return family, socket.SOCK_STREAM, 6, '', (addr, port, 0, 0)
+    return family, socket.SOCK_STREAM, 6, '', (addr, port)
+
+
+V6_A = _info(socket.AF_INET6, '2001:db8::1')
+V6_B = _info(socket.AF_INET6, '2001:db8::2')
+V4_A = _info(socket.AF_INET, '192.0.2.1')
+V4_B = _info(socket.AF_INET, '192.0.2.2')
+
+
+class TestSortAddrinfo(unittest.TestCase):
+    def test_interleave_families(self):
+        c = connector.Connector()
+        self.assertEqual(c._sort_addrinfo('h', [V6_A, V6_B, V4_A, V4_B]), [V6_A, V4_A, V6_B, V4_B])
+        self.assertEqual(c._sort_addrinfo('h', [V4_A, V6_A, V6_B]), [V4_A, V6_A, V6_B])
+
+    def test_failed_family_last(self):
+        c = connector.Connector()
+        c._set_failed_family('h', socket.AF_INET6)
+        self.assertEqual(c._sort_addrinfo('h', [V6_A, V6_B, V4_A, V4_B]), [V4_A, V4_B, V6_A, V6_B])
+        self.assertEqual(c._sort_addrinfo('other', [V6_A, V4_A]), [V6_A, V4_A])
+
+    def test_failure_cache(self):
+        c = connector.Connector()
+        c._set_failed_family('h', socket.AF_INET6)
+        self.assertEqual(c._get_failed_families('h'), {socket.AF_INET6})
+        c._clear_failed_family('h', socket.AF_INET6)
+        self.assertEqual(c._get_failed_families('h'), set())
+        self.assertEqual(c._failed, {})
+
+    def test_failure_expire(self):
+        c = connector.Connector()
+        c._set_failed_family('h', socket.AF_INET6)
+        c._failed['h'][socket.AF_INET6] = 0
+        self.assertEqual(c._get_failed_families('h'), set())
+        self.assertEqual(c._failed, {})
+
+    def test_failure_cache_size(self):
+        c = connector.Connector()
+        c.FAILURE_CACHE_SIZE = 2
+        for host in ('a', 'b', 'c'):
+            c._set_failed_family(host, socket.AF_INET6)
+        self.assertEqual(len(c._failed), 2)
+        self.assertIn('c', c._failed)
+
+
+class TestStaggeredConnect(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.server = self.loop.run_until_complete(self.loop.create_server(asyncio.Protocol, '127.0.0.1', 0))
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    def tearDown(self):
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def _connector(self):
+        c = connector.Connector(attempt_delay=0.05, timeout=2)
+        connect_sock = c._connect_sock
+
+        async def blackhole(loop, family, *args):
+            if family == socket.AF_INET6:
+                await asyncio.sleep(10)
+            return await connect_sock(loop, family, *args)
+
+        c._connect_sock = blackhole
+        return c
+
+    def test_blackholed_family_is_remembered(self):
+        c = self._connector()
+        infos = [_info(socket.AF_INET6, '2001:db8::1', self.port), _info(socket.AF_INET, '127.0.0.1', self.port)]
+        sock = self.loop.run_until_complete(c._staggered_connect('h', list(infos)))
+        sock.close()
+        self.assertEqual(c._get_failed_families('h'), {socket.AF_INET6})
+        self.assertEqual(c._sort_addrinfo('h', infos), infos[::-1])
+
+    def test_connection_refused(self):
+        c = connector.Connector(attempt_delay=0.05, timeout=2)
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        with self.assertRaises(OSError):
+            self.loop.run_until_complete(c._staggered_connect('h', [_info(socket.AF_INET, '127.0.0.1', port)]))
+        self.assertEqual(c._failed, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
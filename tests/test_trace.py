@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import unittest
+from shadowsocks import trace
+
+
+class TestTrace(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'test.trace')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _record(self, *sizes):
+        recorder = trace.TraceRecorder(self.path)
+        conn_id = recorder.open()
+        for event, size in sizes:
+            recorder.record(conn_id, event, size)
+        recorder.record(conn_id, trace.EVENT_CLOSE, 0)
+        recorder.close()
+        return conn_id
+
+    def _events(self, session):
+        return [(event, size) for _, event, size in session.events]
+
+    def test_round_trip(self):
+        self._record((trace.EVENT_UP, 5), (trace.EVENT_DOWN, 1000))
+        self.assertEqual(os.path.getsize(self.path), 5 * trace.RECORD.size)
+        sessions = trace.load_sessions(self.path)
+        self.assertEqual(len(sessions), 1)
+        self.assertEqual(self._events(sessions[0]),
+                         [(trace.EVENT_UP, 5), (trace.EVENT_DOWN, 1000), (trace.EVENT_CLOSE, 0)])
+        offsets = [offset for offset, _, _ in sessions[0].events]
+        self.assertEqual(offsets, sorted(offsets))
+
+    def test_segments(self):
+        # both sessions have conn_id 1, EVENT_BEGIN keeps them apart
+        self._record((trace.EVENT_UP, 1))
+        self._record((trace.EVENT_DOWN, 2))
+        sessions = trace.load_sessions(self.path)
+        self.assertEqual([session.conn_id for session in sessions], [1, 1])
+        self.assertEqual(self._events(sessions[0]), [(trace.EVENT_UP, 1), (trace.EVENT_CLOSE, 0)])
+        self.assertEqual(self._events(sessions[1]), [(trace.EVENT_DOWN, 2), (trace.EVENT_CLOSE, 0)])
+        self.assertLessEqual(sessions[0].start_time, sessions[1].start_time)
+
+    def test_torn_tail(self):
+        self._record((trace.EVENT_UP, 1))
+        with open(self.path, 'ab') as f:
+            f.write(b'\x00' * 5)
+        self.assertEqual(len(trace.load_sessions(self.path)), 1)
+        self._record((trace.EVENT_DOWN, 2))
+        self.assertEqual(os.path.getsize(self.path) % trace.RECORD.size, 0)
+        sessions = trace.load_sessions(self.path)
+        self.assertEqual(len(sessions), 2)
+        self.assertEqual(self._events(sessions[1]), [(trace.EVENT_DOWN, 2), (trace.EVENT_CLOSE, 0)])
+
+    def test_clock_step_back(self):
+        recorder = trace.TraceRecorder(self.path)
+        recorder._last_time += 100
+        conn_id = recorder.open()
+        recorder.record(conn_id, trace.EVENT_UP, 1)
+        recorder.close()
+        self.assertEqual(self._events(trace.load_sessions(self.path)[0]), [(trace.EVENT_UP, 1)])
+
+    def test_size_clamp(self):
+        self._record((trace.EVENT_DOWN, trace.MAX_SIZE + 1))
+        self.assertEqual(trace.load_sessions(self.path)[0].events[0][2], trace.MAX_SIZE)
+
+
+if __name__ == '__main__':
+    unittest.main()